@@ -66,6 +66,8 @@ class CrawlAIService
                 'js_only' => $options['js_only'] ?? false,
                 'wait_for' => $options['wait_for'] ?? '',
                 'screenshot' => false,
+                // Raw html is ~10x the markdown size; skip it unless asked for.
+                'include_html' => $options['include_html'] ?? false,
             ];
 
             $response = $this->request('POST', '/crawl', $payload);
@@ -120,6 +122,7 @@ class CrawlAIService
                 'urls' => $url,
                 'css_selector' => $selectors['container_selector'] ?? 'body',
                 'screenshot' => false,
+                'include_html' => false,
             ];
 
             $response = $this->request('POST', '/crawl', $payload);